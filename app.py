@@ -1,14 +1,22 @@
 # app.py
 # Streamlit app for Brno climate analysis & projections
+import os
+import re
 import streamlit as st
 from datetime import datetime, date
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
 from io import BytesIO
-from matplotlib.backends.backend_pdf import PdfPages
+from pathlib import Path
+import time
+import warnings
+from urllib.error import HTTPError, URLError
+from urllib.request import urlopen
 
-from meteostat import Stations, Daily
+# matplotlib & meteostat are imported lazily where used; pick the headless
+# Agg backend up front (overriding any inherited MPLBACKEND) so pyplot never
+# picks up a GUI one
+os.environ['MPLBACKEND'] = 'Agg'
 
 st.set_page_config(page_title="Brno Klima: Historie & Scénáře", layout="wide")
 
@@ -23,9 +31,59 @@ SCENARIOS = {
 }
 EXTENSION_MULTIPLIER_2300 = {"SSP1-2.6": 1.1, "SSP2-4.5": 1.6, "SSP5-8.5": 2.5}
 
+CACHE_DIR = Path(".cache")   # on-disk Meteostat cache, survives app restarts
+CACHE_TTL = 3600             # seconds, same as the in-process cache
+
+BULK_TIMEOUT = 20            # seconds before the bulk download gives up -> Daily()
+CACHE_SOURCES = ('bulk', 'meteostat')
+
+def bulk_daily_source(station_id: str):
+    # URL and column layout of the file meteostat's Daily() itself downloads,
+    # taken from the installed meteostat (pinned to 1.6.x in requirements.txt)
+    from meteostat import Daily
+    from meteostat.utilities.endpoint import generate_endpoint_path
+    url = Daily.endpoint + generate_endpoint_path(Daily.granularity, station_id)
+    return url, list(Daily._columns)
+
+def fetch_bulk_daily(station_id: str, start: datetime, end: datetime):
+    # same file and [start, end] window as Daily(station_id, start, end).fetch(),
+    # but pyarrow's multithreaded CSV reader parses it straight to float32
+    url, cols = bulk_daily_source(station_id)
+    with urlopen(url, timeout=BULK_TIMEOUT) as resp:
+        data = resp.read()
+    df = pd.read_csv(
+        BytesIO(data), compression='gzip', names=cols, parse_dates=[cols[0]],
+        dtype={c: 'float32' for c in cols[1:]}, engine='pyarrow',
+    )
+    df = df.set_index(cols[0]).rename_axis('time').sort_index()
+    return df.loc[start:end, ['tavg','tmin','tmax','prcp','wspd']]
+
 @st.cache_data(show_spinner=True, ttl=3600)
 def fetch_daily(station_id: str, start: datetime, end: datetime):
-    df = Daily(station_id, start, end).fetch()
+    # station_id comes straight from the sidebar -> only plain IDs get a cache file;
+    # the key records which source produced the frame
+    cache_paths = {}
+    if re.fullmatch(r'\w+', station_id):
+        cache_paths = {
+            src: CACHE_DIR / f"{station_id}_{start:%Y%m%d}_{end:%Y%m%d}_{src}.parquet"
+            for src in CACHE_SOURCES
+        }
+    for cache_path in cache_paths.values():
+        if cache_path.exists() and time.time() - cache_path.stat().st_mtime < CACHE_TTL:
+            try:
+                return pd.read_parquet(cache_path)
+            except (OSError, ValueError):
+                pass  # unreadable cache file -> try the next one / fetch again
+    try:
+        df = fetch_bulk_daily(station_id, start, end)
+        source = 'bulk'
+    # HTTPError < URLError < OSError (incl. timeouts); pyarrow.ArrowInvalid < ValueError;
+    # KeyError = expected columns missing
+    except (HTTPError, URLError, OSError, ValueError, KeyError) as e:
+        warnings.warn(f"Meteostat bulk download failed ({e!r}), falling back to meteostat Daily()")
+        from meteostat import Daily
+        df = Daily(station_id, start, end).fetch()
+        source = 'meteostat'
     # standardize names
     rename = {'wspd':'wind'}
     for old, new in rename.items():
@@ -33,105 +91,162 @@ def fetch_daily(station_id: str, start: datetime, end: datetime):
             df = df.rename(columns={old:new})
     # keep a subset
     keep = [c for c in ['tavg','tmin','tmax','prcp','wind'] if c in df.columns]
-    return df[keep].copy()
+    df = df.loc[:, keep]
+    # float32 is plenty for station data and halves memory for resampling/export
+    df = df.astype({c: 'float32' for c in df.columns})
+    # the disk cache is best-effort; never cache an empty (failed) download
+    cache_path = cache_paths.get(source)
+    if cache_path is not None and not df.empty:
+        try:
+            CACHE_DIR.mkdir(exist_ok=True)
+            df.to_parquet(cache_path, compression='zstd')
+        except OSError:
+            pass
+    return df
 
+@st.cache_data(show_spinner=False, ttl=3600)
 def aggregate(df: pd.DataFrame):
-    m = df.resample('MS').agg({'tavg':'mean','tmin':'mean','tmax':'mean','prcp':'sum','wind':'mean'})
-    a = df.resample('YS').agg({'tavg':'mean','tmin':'mean','tmax':'mean','prcp':'sum','wind':'mean'})
+    # aggregate in float64 and round: summing float32 daily values (or widening
+    # them for export) would otherwise show noise like 316.8999938964844.
+    # prcp sums keep the data's 0.1 mm resolution, means get 3 decimals
+    df = df.astype('float64')
+    decimals = {'tavg':3,'tmin':3,'tmax':3,'prcp':1,'wind':3}
+    m = df.resample('MS').agg({'tavg':'mean','tmin':'mean','tmax':'mean','prcp':'sum','wind':'mean'}).round(decimals)
+    a = df.resample('YS').agg({'tavg':'mean','tmin':'mean','tmax':'mean','prcp':'sum','wind':'mean'}).round(decimals)
     return m, a
 
+@st.cache_data(show_spinner=False, ttl=3600)
 def build_projections(annual: pd.DataFrame, scenarios: dict):
     base_year = 2025
-    baseline_temp = annual['tavg'].loc[:str(base_year)].tail(30).mean()
-    baseline_prcp = annual['prcp'].loc[:str(base_year)].tail(30).mean()
-    baseline_wind = annual['wind'].loc[:str(base_year)].tail(30).mean()
-    targets = [2035, 2125, 3025]
-    rows = []
-    for scen, vals in scenarios.items():
-        for target_year in targets:
-            if target_year <= 2100:
-                frac = (target_year - base_year) / (2100 - base_year)
-                frac = max(0, min(1, frac))
-                dT = vals['temp_2100'] * frac
-            elif target_year <= 2300:
-                dT_2300 = vals['temp_2100'] * EXTENSION_MULTIPLIER_2300[scen]
-                frac = (target_year - 2100) / (2300 - 2100)
-                dT = vals['temp_2100'] + frac * (dT_2300 - vals['temp_2100'])
-            else:
-                dT = vals['temp_2100'] * EXTENSION_MULTIPLIER_2300[scen]
-            if target_year <= 2100:
-                frac = (target_year - base_year) / (2100 - base_year)
-                frac = max(0, min(1, frac))
-                dP_pct = vals['prc_2100_pct'] * frac
-            else:
-                dP_pct = vals['prc_2100_pct']
-            dW_pct = vals.get('wind_2100_pct', 0)
-            rows.append({
-                'scenario': scen,
-                'target_year': target_year,
-                'delta_T_C': round(float(dT), 3),
-                'delta_P_pct': round(float(dP_pct), 2),
-                'delta_W_pct': round(float(dW_pct), 2),
-                'proj_tavg_C': round(float(baseline_temp + dT), 3),
-                'proj_prcp_mm_y': round(float(baseline_prcp * (1 + dP_pct/100.0)), 1),
-                'proj_wind_avg': round(float(baseline_wind * (1 + dW_pct/100.0)), 3)
-            })
-    return pd.DataFrame(rows).sort_values(['scenario','target_year'])
-
-def to_excel_bytes(raw, monthly, annual, projections):
+    baseline = annual.loc[:str(base_year)].tail(30)[['tavg','prcp','wind']].mean()
+    baseline_temp, baseline_prcp, baseline_wind = (float(baseline[c]) for c in ['tavg','prcp','wind'])
+    horizons = np.array([10, 100, 1000])
+    targets = base_year + horizons
+    names = list(scenarios)
+    # scenario params as column vectors -> (scenario, target) grid by broadcasting
+    temp2100 = np.array([scenarios[s]['temp_2100'] for s in names], dtype=float)[:, None]
+    prc2100 = np.array([scenarios[s]['prc_2100_pct'] for s in names], dtype=float)[:, None]
+    wind2100 = np.array([scenarios[s].get('wind_2100_pct', 0) for s in names], dtype=float)[:, None]
+    ext = np.array([EXTENSION_MULTIPLIER_2300[s] for s in names], dtype=float)[:, None]
+    ty = np.broadcast_to(targets[None, :], (len(names), len(targets)))
+
+    frac_to2100 = np.clip((ty - base_year) / (2100 - base_year), 0, 1)
+    dT_2300 = temp2100 * ext
+    frac_2300 = (ty - 2100) / (2300 - 2100)
+    dT_mid = temp2100 + frac_2300 * (dT_2300 - temp2100)
+    dT = np.where(ty <= 2100, temp2100 * frac_to2100, np.where(ty <= 2300, dT_mid, dT_2300))
+    dP_pct = np.where(ty <= 2100, prc2100 * frac_to2100, prc2100)
+    dW_pct = np.broadcast_to(wind2100, ty.shape)
+
+    df = pd.DataFrame({
+        'scenario': np.repeat(names, len(targets)),
+        'target_year': ty.ravel(),
+        'horizon_years': np.tile(horizons, len(names)),
+        'delta_T_C': dT.ravel(),
+        'delta_P_pct': dP_pct.ravel(),
+        'delta_W_pct': dW_pct.ravel(),
+        'proj_tavg_C': (baseline_temp + dT).ravel(),
+        'proj_prcp_mm_y': (baseline_prcp * (1 + dP_pct/100.0)).ravel(),
+        'proj_wind_avg': (baseline_wind * (1 + dW_pct/100.0)).ravel(),
+    })
+    df = df.round({'delta_T_C': 3, 'delta_P_pct': 2, 'delta_W_pct': 2,
+                   'proj_tavg_C': 3, 'proj_prcp_mm_y': 1, 'proj_wind_avg': 3})
+    # rows already come out scenario-major, horizon-minor -> no sort needed
+    return df
+
+def _append_sheet(wb, title, df, index=True):
+    # constant_memory flushes each row once the next one starts -> write strictly
+    # row by row (pandas' to_excel goes column by column and would lose cells)
+    ws = wb.add_worksheet(title)
+    if index:
+        df = df.rename_axis(df.index.name or 'date').reset_index()
+    ws.write_row(0, 0, list(df.columns))
+    # NaN is not valid in XLSX numeric cells -> write empty cells instead;
+    # object dtype also hands xlsxwriter plain Python floats
+    df = df.astype(object).where(df.notna(), None)
+    # plain tuples, never df.iloc[i] per row
+    for r, row in enumerate(df.itertuples(index=False, name=None), start=1):
+        ws.write_row(r, 0, row)
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def to_excel_bytes(monthly, annual, projections):
     import io
+    import xlsxwriter
     bio = io.BytesIO()
-    with pd.ExcelWriter(bio, engine='openpyxl') as xw:
-        raw.to_excel(xw, sheet_name='RawHistorical')
-        monthly.to_excel(xw, sheet_name='MonthlyAgg')
-        annual.to_excel(xw, sheet_name='AnnualAgg')
-        projections.to_excel(xw, sheet_name='Projections', index=False)
-        methods = pd.DataFrame({
-            'Section':[
-                'Data source','Station','Period','Variables','Aggregation',
-                'Scenarios','Uncertainties','Limitations'
-            ],
-            'Details':[
-                'Meteostat Python library (meteostat.net) – daily observations',
-                'Brno–Tuřany, Meteostat/WMO station 11723 (ICAO LKTB)',
-                '1950-01-01 to today (as available)',
-                'Daily tavg, tmin, tmax (°C), precipitation (mm), wind speed',
-                'Monthly mean temperatures & winds; monthly sum precipitation. Annual analogues.',
-                'AR6-informed deltas for Central Europe (SSP1-2.6, SSP2-4.5, SSP5-8.5) – simplified',
-                'Observational gaps; inhomogeneities; station moves; representativeness; scenario spread',
-                '1000-year horizon is illustrative; post-2300 deltas frozen'
-            ]
-        })
-        methods.to_excel(xw, sheet_name='Methods', index=False)
-    bio.seek(0)
-    return bio
+    wb = xlsxwriter.Workbook(bio, {
+        'constant_memory': True,
+        'strings_to_numbers': False,
+        'default_date_format': 'yyyy-mm-dd',
+    })
+    _append_sheet(wb, 'MonthlyAgg', monthly)
+    _append_sheet(wb, 'AnnualAgg', annual)
+    _append_sheet(wb, 'Projections', projections, index=False)
+    methods = pd.DataFrame({
+        'Section':[
+            'Data source','Station','Period','Variables','Aggregation',
+            'Scenarios','Uncertainties','Limitations'
+        ],
+        'Details':[
+            'Meteostat Python library (meteostat.net) – daily observations',
+            'Brno–Tuřany, Meteostat/WMO station 11723 (ICAO LKTB)',
+            '1950-01-01 to today (as available)',
+            'Daily tavg, tmin, tmax (°C), precipitation (mm), wind speed',
+            'Monthly mean temperatures & winds; monthly sum precipitation. Annual analogues.',
+            'AR6-informed deltas for Central Europe (SSP1-2.6, SSP2-4.5, SSP5-8.5) – simplified',
+            'Observational gaps; inhomogeneities; station moves; representativeness; scenario spread',
+            '1000-year horizon is illustrative; post-2300 deltas frozen'
+        ]
+    })
+    _append_sheet(wb, 'Methods', methods, index=False)
+    wb.close()
+    return bio.getvalue()
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def to_csv_bytes(raw):
+    # daily data go out as CSV – far cheaper than writing them as an XLSX sheet
+    return raw.to_csv().encode('utf-8')
 
+PAGE_DPI = 100  # PNG charts on the Streamlit page
+
+TAVG_TITLE = 'Roční průměrná teplota – Brno (historie)'
+PRCP_TITLE = 'Roční úhrn srážek – Brno (historie)'
+
+def plot_annual(ax, series: pd.Series, ylabel: str, title: str = None):
+    series.plot(ax=ax)
+    if title:
+        ax.set_title(title)
+    ax.set_xlabel('Rok'); ax.set_ylabel(ylabel)
+
+@st.cache_data(show_spinner=False, ttl=3600)
+def render_annual_png(series: pd.Series, ylabel: str):
+    # PNG bytes for st.image: reruns reuse the rendered chart instead of
+    # redrawing it (only the Series is hashed, not the whole annual frame)
+    import matplotlib.pyplot as plt
+    buf = BytesIO()
+    fig = plt.figure(figsize=(8, 4))
+    plot_annual(fig.add_subplot(111), series, ylabel)
+    fig.savefig(buf, format='png', dpi=PAGE_DPI)
+    plt.close(fig)
+    return buf.getvalue()
+
+@st.cache_data(show_spinner=False, ttl=3600)
 def to_pdf_bytes(annual, projections):
+    import matplotlib.pyplot as plt
+    from matplotlib.backends.backend_pdf import PdfPages
     buf = BytesIO()
     with PdfPages(buf) as pdf:
-        # TAVG plot
-        fig = plt.figure(figsize=(8.27, 5))
-        ax = fig.add_subplot(111)
-        annual['tavg'].plot(ax=ax)
-        ax.set_title('Roční průměrná teplota – Brno (historie)')
-        ax.set_xlabel('Rok'); ax.set_ylabel('°C')
-        pdf.savefig(fig); plt.close(fig)
-        # PRCP plot
-        fig = plt.figure(figsize=(8.27, 5))
-        ax = fig.add_subplot(111)
-        annual['prcp'].plot(ax=ax)
-        ax.set_title('Roční úhrn srážek – Brno (historie)')
-        ax.set_xlabel('Rok'); ax.set_ylabel('mm/rok')
-        pdf.savefig(fig); plt.close(fig)
-        # Projections table
-        fig = plt.figure(figsize=(8.27, 5))
-        ax = fig.add_subplot(111); ax.axis('off')
+        # one A4 page: tavg, prcp and the projections summary -> a single savefig
+        fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(8.27, 11.69))
+        plot_annual(ax1, annual['tavg'], '°C', TAVG_TITLE)
+        plot_annual(ax2, annual['prcp'], 'mm/rok', PRCP_TITLE)
+        # 9-line text summary, full table is in the Excel
+        ax3.axis('off')
         txt = projections.to_string(index=False)
-        ax.text(0.01, 0.99, txt, family='monospace', va='top')
-        ax.set_title('Projekce – přehled')
+        ax3.text(0.01, 0.99, txt, family='monospace', va='top', fontsize=6)
+        ax3.set_title('Projekce – přehled')
+        fig.tight_layout()
         pdf.savefig(fig); plt.close(fig)
-    buf.seek(0)
-    return buf
+    return buf.getvalue()
 
 # Sidebar
 st.sidebar.header("Nastavení dat")
@@ -157,25 +272,22 @@ if run:
     col1, col2 = st.columns([2,1])
     with col1:
         st.subheader("Roční průměrná teplota")
-        fig = plt.figure(figsize=(8,4)); ax = fig.add_subplot(111)
-        annual['tavg'].plot(ax=ax)
-        ax.set_xlabel("Rok"); ax.set_ylabel("°C")
-        st.pyplot(fig); plt.close(fig)
+        st.image(render_annual_png(annual['tavg'], '°C'))
 
         st.subheader("Roční úhrn srážek")
-        fig = plt.figure(figsize=(8,4)); ax = fig.add_subplot(111)
-        annual['prcp'].plot(ax=ax)
-        ax.set_xlabel("Rok"); ax.set_ylabel("mm/rok")
-        st.pyplot(fig); plt.close(fig)
+        st.image(render_annual_png(annual['prcp'], 'mm/rok'))
 
     with col2:
         st.subheader("Projekce (shrnutí)")
         st.dataframe(projections, use_container_width=True)
 
         # Downloads
-        xls = to_excel_bytes(raw, monthly, annual, projections)
+        xls = to_excel_bytes(monthly, annual, projections)
         st.download_button("Stáhnout Excel", data=xls, file_name="brno_climate_excel.xlsx", mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
 
+        csv = to_csv_bytes(raw)
+        st.download_button("Stáhnout surová data (CSV)", data=csv, file_name="brno_climate_raw.csv", mime="text/csv")
+
         pdf = to_pdf_bytes(annual, projections)
         st.download_button("Stáhnout PDF", data=pdf, file_name="brno_climate_summary.pdf", mime="application/pdf")
 
@@ -94,22 +94,21 @@ def build_projections(annual, scenarios):
     baseline_prcp = annual['prcp'].loc[:str(base_year)].tail(30).mean()
     baseline_wind = annual['wind'].loc[:str(base_year)].tail(30).mean()
     target_years = [2035, 2125, 3025]
+    span = 2100 - base_year
     rows = []
     for scen, vals in scenarios.items():
+        ext_mul = EXTENSION_MULTIPLIER_2300[scen]
+        dT_2300 = vals['temp_2100'] * ext_mul
         for target_year in target_years:
+            frac = max(0.0, min(1.0, (target_year - base_year) / span))
             if target_year <= 2100:
-                frac = (target_year - base_year) / (2100 - base_year)
-                frac = max(0, min(1, frac))
                 dT = vals['temp_2100'] * frac
             elif target_year <= 2300:
-                dT_2300 = vals['temp_2100'] * EXTENSION_MULTIPLIER_2300[scen]
-                frac = (target_year - 2100) / (2300 - 2100)
-                dT = vals['temp_2100'] + frac * (dT_2300 - vals['temp_2100'])
+                frac_2300 = (target_year - 2100) / (2300 - 2100)
+                dT = vals['temp_2100'] + frac_2300 * (dT_2300 - vals['temp_2100'])
             else:
-                dT = vals['temp_2100'] * EXTENSION_MULTIPLIER_2300[scen]
+                dT = dT_2300
             if target_year <= 2100:
-                frac = (target_year - base_year) / (2100 - base_year)
-                frac = max(0, min(1, frac))
                 dP_pct = vals['prc_2100_pct'] * frac
             else:
                 dP_pct = vals['prc_2100_pct']
@@ -120,14 +119,18 @@ def build_projections(annual, scenarios):
             rows.append({
                 'scenario': scen,
                 'target_year': target_year,
-                'delta_T_C': round(float(dT), 3),
-                'delta_P_pct': round(float(dP_pct), 2),
-                'delta_W_pct': round(float(dW_pct), 2),
-                'proj_tavg_C': round(float(proj_temp), 3),
-                'proj_prcp_mm_y': round(float(proj_prcp), 1),
-                'proj_wind_avg': round(float(proj_wind), 3)
+                'delta_T_C': float(dT),
+                'delta_P_pct': float(dP_pct),
+                'delta_W_pct': float(dW_pct),
+                'proj_tavg_C': float(proj_temp),
+                'proj_prcp_mm_y': float(proj_prcp),
+                'proj_wind_avg': float(proj_wind)
             })
-    return pd.DataFrame(rows).sort_values(['scenario','target_year'])
+    df = pd.DataFrame(rows).round({
+        'delta_T_C': 3, 'delta_P_pct': 2, 'delta_W_pct': 2,
+        'proj_tavg_C': 3, 'proj_prcp_mm_y': 1, 'proj_wind_avg': 3
+    })
+    return df.sort_values(['scenario','target_year'])
 
 # ---------------------------
 # EXPORTS